@@ -8,9 +8,26 @@
 
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pacsv
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import os
+import io
+import codecs
 import zipfile
 import tempfile
+import uuid
+import shutil
+import time
+import hashlib
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Store strings that pandas infers itself (e.g. categorical categories) as
+# Arrow-backed str instead of NumPy object arrays.
+pd.options.future.infer_string = True
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -18,108 +35,530 @@ st.set_page_config(
     page_title="Master CSV Compiler"
 )
 
+# Compiled master tables are cached here as 'v<CACHE_VERSION>-<sha256 of zip>.parquet',
+# so re-uploading an archive that was already processed skips all CSV parsing.
+# The CSV download for the same archive is kept alongside with a '.csv' suffix;
+# results that were not cached get a per-session CSV file instead.
+# Bump CACHE_VERSION whenever a change alters the compiled output, so entries
+# written by older code are no longer picked up.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CACHE_VERSION = 1
+# Number of compiled masters, and separately of CSV downloads, kept in CACHE_DIR;
+# the least recently used entries beyond this are deleted.
+MAX_CACHE_ENTRIES = 4
+# Per-compile spill directories in CACHE_DIR start with this prefix. Ones left
+# behind (on Windows they can't be removed while still memory-mapped) are
+# deleted by a later compile once they are older than SPILL_DIR_MAX_AGE seconds;
+# younger ones may belong to a compile still running in another session.
+SPILL_DIR_PREFIX = 'spill-'
+SPILL_DIR_MAX_AGE = 60 * 60
+
+DETAIL_SUFFIX = '_e_detail.csv'
+SUP_SUFFIX = '_e_sup.csv'
+
+# Known columns of the electoral roll CSVs. Pinning their types lets the CSV
+# reader skip type inference for them; EPIC numbers are IDs and must stay text
+# even when they happen to look numeric. Columns absent from a file are ignored.
+ELECTORAL_COLUMN_TYPES = {
+    "AC_NO": pa.int32(),
+    "PART_NO": pa.int32(),
+    "SLNO_IN_PART": pa.int32(),
+    "EPIC_NO": pa.string(),
+}
+
+# String columns with fewer distinct values than this fraction of rows (state,
+# district, gender, status, ...) are dictionary-encoded in the master table.
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
 # =============================================================================
 # ---                      CORE COMPILATION LOGIC                           ---
 # =============================================================================
-# (This core function remains unchanged, as it is correct)
-def compile_csv_files_from_zip(uploaded_zip_file):
-    log_messages = []
-    with tempfile.TemporaryDirectory() as temp_dir:
-        log_messages.append("✔️ Zip file uploaded. Extracting contents...")
+def _zip_hash(buf):
+    """Returns the SHA-256 hex digest of the uploaded zip bytes."""
+    return hashlib.sha256(buf).hexdigest()
+
+def _cache_path(zip_hash, suffix):
+    """Returns the path of a cache entry for the archive with this hash."""
+    return os.path.join(CACHE_DIR, f"v{CACHE_VERSION}-{zip_hash}{suffix}")
+
+def _evict_cache_entries(suffix, keep_path):
+    """
+    Marks `keep_path` as just used, then deletes the least recently used cache
+    entries with this suffix beyond MAX_CACHE_ENTRIES.
+    """
+    os.utime(keep_path)
+    entries = []
+    for entry in os.scandir(CACHE_DIR):
+        try:
+            if entry.is_file() and entry.name.endswith(suffix):
+                entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            pass
+    entries.sort(reverse=True)
+    for _, path in entries[MAX_CACHE_ENTRIES:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _arrow_types_mapper(arrow_type):
+    """
+    Maps Arrow types to pd.ArrowDtype when converting to pandas, except for
+    dictionary-encoded columns, which become regular pandas categoricals.
+    """
+    if pa.types.is_dictionary(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+def _dictionary_encode_low_cardinality(tbl):
+    """
+    Dictionary-encodes string columns whose distinct-value ratio is below
+    CATEGORY_MAX_UNIQUE_RATIO, so each repeated value is stored only once.
+    """
+    if not tbl.num_rows:
+        return tbl
+    for i, field in enumerate(tbl.schema):
+        if not (pa.types.is_string(field.type) or pa.types.is_large_string(field.type)):
+            continue
+        column = tbl.column(i)
+        if pc.count_distinct(column, mode='all').as_py() / tbl.num_rows < CATEGORY_MAX_UNIQUE_RATIO:
+            tbl = tbl.set_column(i, field.name, column.dictionary_encode())
+    return tbl
+
+def _read_cached_master(cache_path):
+    """
+    Loads a previously compiled master table from the Parquet cache. The
+    original processing log is stored in the schema metadata and returned
+    alongside the DataFrame.
+    """
+    master_tbl = pq.read_table(cache_path)
+    cached_log = (master_tbl.schema.metadata or {}).get(b'compile_log', b'').decode('utf-8')
+    master_df = master_tbl.to_pandas(types_mapper=_arrow_types_mapper, self_destruct=True)
+    # Mark the entry as just used, so _evict_cache_entries keeps it longer.
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return master_df, cached_log
+
+def _write_cached_master(master_tbl, log_text, cache_path):
+    """Writes the master table and its log to the Parquet cache atomically."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    metadata = dict(master_tbl.schema.metadata or {})
+    metadata[b'compile_log'] = log_text.encode('utf-8')
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        pq.write_table(master_tbl.replace_schema_metadata(metadata), tmp_path, compression='zstd')
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _evict_cache_entries('.parquet', cache_path)
+
+def _dedupe_column_names(tbl):
+    """
+    Renames repeated column names the way pd.read_csv does ('X', 'X.1', ...,
+    skipping names that already occur in the header), since duplicate names
+    can't be unified across files.
+    """
+    names = tbl.column_names
+    if len(set(names)) == len(names):
+        return tbl
+    header, counts, deduped = set(names), {}, []
+    for name in names:
+        col, cur_count = name, counts.get(name, 0)
+        while cur_count > 0:
+            counts[name] = cur_count + 1
+            col = f"{name}.{cur_count}"
+            cur_count = cur_count + 1 if col in header else counts.get(col, 0)
+        counts[col] = cur_count + 1
+        deduped.append(col)
+    return tbl.rename_columns(deduped)
+
+def _read_csv_fast(source, column_names=None):
+    """
+    Parses a CSV with PyArrow's multi-threaded reader into an Arrow Table.
+    When `column_names` is given the source must start after the header row.
+    Empty files raise pandas' EmptyDataError, just like pd.read_csv, so
+    callers keep a single error contract, and repeated column names are
+    renamed as pd.read_csv renames them.
+    """
+    try:
+        tbl = pacsv.read_csv(
+            source,
+            read_options=pacsv.ReadOptions(use_threads=True, block_size=8 << 20, column_names=column_names),
+            convert_options=pacsv.ConvertOptions(column_types=ELECTORAL_COLUMN_TYPES),
+        )
+    except pa.ArrowInvalid as e:
+        if "Empty CSV file" in str(e):
+            raise pd.errors.EmptyDataError("No columns to parse from file") from e
+        raise
+    return _dedupe_column_names(tbl)
+
+def _read_csv_pandas(source):
+    """
+    Fallback for files PyArrow's reader rejects, such as rows with fewer fields
+    than the header: pandas pads them with NaN, as the original reader did.
+    Returns an Arrow Table, so callers stay on a single table type. Text
+    columns of ELECTORAL_COLUMN_TYPES are read as text, and known columns are
+    cast to their pinned types where the values allow it, so both readers type
+    them the same way.
+    """
+    text_columns = {name: str for name, t in ELECTORAL_COLUMN_TYPES.items() if pa.types.is_string(t)}
+    tbl = pa.Table.from_pandas(pd.read_csv(source, dtype=text_columns), preserve_index=False)
+    for i, name in enumerate(tbl.column_names):
+        if name in ELECTORAL_COLUMN_TYPES:
+            try:
+                tbl = tbl.set_column(i, name, tbl.column(i).cast(ELECTORAL_COLUMN_TYPES[name]))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                pass
+    return tbl.replace_schema_metadata(None)
+
+def _spill_to_disk(tbl, path):
+    """
+    Writes a table to an Arrow IPC file and returns it memory-mapped back, so
+    its data lives in the (reclaimable) OS page cache instead of on the heap.
+    """
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, tbl.schema) as writer:
+        writer.write_table(tbl)
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+def _conflicting_fields(schemas):
+    """Returns the names of fields whose types cannot be promoted to a common type."""
+    types_by_name = {}
+    for schema in schemas:
+        for field in schema:
+            types_by_name.setdefault(field.name, set()).add(field.type)
+    conflicting = set()
+    for name, types in types_by_name.items():
+        try:
+            pa.unify_schemas([pa.schema([(name, t)]) for t in types], promote_options="permissive")
+        except pa.ArrowTypeError:
+            conflicting.add(name)
+    return conflicting
+
+def _remove_stale_spill_dirs():
+    """Deletes spill directories in CACHE_DIR older than SPILL_DIR_MAX_AGE."""
+    cutoff = time.time() - SPILL_DIR_MAX_AGE
+    for entry in os.scandir(CACHE_DIR):
         try:
-            with zipfile.ZipFile(uploaded_zip_file, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            log_messages.append("✔️ Extraction complete.")
+            if entry.name.startswith(SPILL_DIR_PREFIX) and entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+def _make_spill_dir(log):
+    """
+    Creates this compile's spill directory in CACHE_DIR, after removing stale
+    ones. If CACHE_DIR can't be written, the system temp dir is used instead
+    and the log says so.
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _remove_stale_spill_dirs()
+        return tempfile.TemporaryDirectory(prefix=SPILL_DIR_PREFIX, dir=CACHE_DIR, ignore_cleanup_errors=True)
+    except OSError as e:
+        print(f"⚠️ WARNING: Could not use the cache folder for temporary files, using the system temp folder. Reason: {e}", file=log)
+        return tempfile.TemporaryDirectory(prefix=SPILL_DIR_PREFIX, ignore_cleanup_errors=True)
+
+def _concat_unified(tables):
+    """
+    Concatenates tables whose schemas may have drifted (extra or reordered
+    columns, widened types) into one table with the unified schema. Tables that
+    already match it are used as-is, so the common case is a metadata-only
+    concat with no column copies. A column that is numeric in one file and text
+    in another becomes text in all of them, like pandas' object columns.
+    """
+    if len(tables) == 1:
+        return tables[0]
+    try:
+        unified = pa.unify_schemas([t.schema for t in tables], promote_options="permissive")
+    except pa.ArrowTypeError:
+        conflicting = _conflicting_fields([t.schema for t in tables])
+        tables = [
+            pa.Table.from_arrays(
+                [t.column(i).cast(pa.string()) if f.name in conflicting else t.column(i)
+                 for i, f in enumerate(t.schema)],
+                names=t.column_names,
+            )
+            for t in tables
+        ]
+        unified = pa.unify_schemas([t.schema for t in tables], promote_options="permissive")
+    aligned = []
+    for t in tables:
+        if t.schema != unified:
+            t = pa.Table.from_arrays(
+                [t.column(f.name).cast(f.type) if f.name in t.column_names else pa.nulls(t.num_rows, f.type)
+                 for f in unified],
+                schema=unified,
+            )
+        aligned.append(t)
+    return pa.concat_tables(aligned)
+
+def _stored_member_buffer(upload_view, info):
+    """
+    Returns the bytes of a stored (uncompressed, unencrypted) member as a
+    zero-copy slice of the in-memory upload, or None if it must be decompressed.
+    The CRC-32 is checked as zip_ref.open() would, raising BadZipFile on a
+    mismatch.
+    """
+    offset = info.header_offset
+    if (info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1
+            or upload_view[offset:offset + 4] != b'PK\x03\x04'):
+        return None
+    # The local header is 30 fixed bytes followed by the file name and the
+    # extra field, whose lengths are stored at offsets 26 and 28.
+    name_len, extra_len = struct.unpack('<HH', upload_view[offset + 26:offset + 30])
+    start = offset + 30 + name_len + extra_len
+    member_view = upload_view[start:start + info.file_size]
+    if zlib.crc32(member_view) != info.CRC:
+        raise zipfile.BadZipFile(f"Bad CRC-32 for file {info.filename!r}")
+    return pa.py_buffer(member_view)
+
+def _record_column_plan(column_plan, header, tbl):
+    """
+    Stores the header line and column names of the first member parsed, unless
+    another thread got there first. Headers with quotes are skipped, since
+    their first physical line may not be the whole header row. Only names are
+    recorded, so which member finishes first never changes the result.
+    """
+    if not header.endswith(b'\n') or b'"' in header:
+        return
+    column_plan.setdefault('plan', (header, tbl.column_names))
+
+def _read_member(zip_ref, upload_view, info, column_plan):
+    """
+    Parses one CSV member of the archive. Stored (uncompressed) members are
+    handed to the parser as a zero-copy slice of the in-memory upload, the
+    in-memory counterpart of memory-mapping an extracted file; compressed or
+    encrypted members are decompressed through zip_ref.open().
+
+    `column_plan` is shared by all reads of one compilation: members whose
+    header line is byte-identical to the first parsed member's are read with
+    its column names, skipping the header row; types are still inferred per
+    member. A member that fails this way is re-read from the start.
+    """
+    data = _stored_member_buffer(upload_view, info)
+    plan = column_plan.get('plan')
+    if plan is not None:
+        header, names = plan
+        try:
+            if data is not None:
+                if data[:len(header)].to_pybytes() == header:
+                    return _read_csv_fast(data[len(header):], names)
+            else:
+                with zip_ref.open(info) as f:
+                    if f.readline() == header:
+                        return _read_csv_fast(f, names)
+        except (pa.ArrowInvalid, pd.errors.EmptyDataError):
+            pass
+    try:
+        if data is not None:
+            tbl = _read_csv_fast(data)
+        else:
+            with zip_ref.open(info) as f:
+                tbl = _read_csv_fast(f)
+    except pa.ArrowInvalid:
+        # Malformed for PyArrow (e.g. short rows): let pandas parse it instead.
+        with (pa.BufferReader(data) if data is not None else zip_ref.open(info)) as f:
+            return _read_csv_pandas(f)
+    if data is not None:
+        head = data[:1 << 16].to_pybytes()
+        header = head[:head.find(b'\n') + 1]
+    elif plan is None:
+        with zip_ref.open(info) as f:
+            header = f.readline()
+    if plan is None:
+        _record_column_plan(column_plan, header, tbl)
+    return tbl
+
+def _process_pair(zip_ref, upload_view, column_plan, base_name, members, spill_dir):
+    """
+    Reads one detail/sup pair straight out of the archive and spills each file
+    to `spill_dir`. Runs on a worker thread, so instead of touching shared state
+    it returns (tables, rows_detail, rows_sup, status, msg) for the caller to merge.
+    """
+    if 'detail' not in members:
+        return None, 0, 0, 'skipped', f"  -> ⚠️ WARNING: Skipping {base_name} (essential detail file is missing)."
+    rows_detail, rows_sup = 0, 0
+    try:
+        detail_tbl = _read_member(zip_ref, upload_view, members['detail'], column_plan)
+        rows_detail = detail_tbl.num_rows
+        tables_for_pair = [_spill_to_disk(detail_tbl, os.path.join(spill_dir, f"{base_name}_detail.arrow"))]
+        if 'sup' in members:
+            try:
+                sup_tbl = _read_member(zip_ref, upload_view, members['sup'], column_plan)
+                if sup_tbl.num_rows:
+                    rows_sup = sup_tbl.num_rows
+                    tables_for_pair.append(_spill_to_disk(sup_tbl, os.path.join(spill_dir, f"{base_name}_sup.arrow")))
+            except pd.errors.EmptyDataError:
+                pass
+        return tables_for_pair, rows_detail, rows_sup, 'processed', f"  -> Processed: {base_name}"
+    except Exception as e:
+        return None, rows_detail, rows_sup, 'skipped', f"  -> ❌ ERROR processing {base_name}: {e}"
+
+# Returns (master_df, log_text, is_cached); is_cached is True only when the
+# master is the clean result stored in the Parquet cache for this zip hash.
+def compile_csv_files_from_zip(uploaded_zip_file, zip_hash):
+    log = io.StringIO()
+    cache_path = _cache_path(zip_hash, '.parquet')
+    if os.path.exists(cache_path):
+        try:
+            master_df, cached_log = _read_cached_master(cache_path)
+            print("✔️ This zip file was compiled before. Loaded the master file from cache.\n", file=log)
+            log.write(cached_log)
+            return master_df, log.getvalue(), True
         except Exception as e:
-            log_messages.append(f"❌ ERROR: Could not extract zip file. Reason: {e}")
-            return None, "\n".join(log_messages)
-        log_messages.append("\n--- Part 1: Finding and Grouping File Pairs ---")
+            print(f"⚠️ WARNING: Could not read cached result, recompiling. Reason: {e}", file=log)
+    print("✔️ Zip file uploaded. Reading archive index...", file=log)
+    try:
+        zip_ref = zipfile.ZipFile(uploaded_zip_file, 'r')
+        print("✔️ Archive opened. CSV files are read directly from it (no extraction).", file=log)
+    except Exception as e:
+        print(f"❌ ERROR: Could not open zip file. Reason: {e}", file=log)
+        return None, log.getvalue(), False
+    with zip_ref:
+        # Zero-copy view of the uploaded bytes, used to parse stored members in place.
+        upload_view = uploaded_zip_file.getbuffer()
+        print("\n--- Part 1: Finding and Grouping File Pairs ---", file=log)
         file_pairs = {}
-        for root, _, filenames in os.walk(temp_dir):
-            for filename in filenames:
-                if filename.startswith('._'):
-                    continue
-                base_name, file_type = None, None
-                if filename.endswith('_e_detail.csv'):
-                    base_name, file_type = filename.replace('_e_detail.csv', ''), 'detail'
-                elif filename.endswith('_e_sup.csv'):
-                    base_name, file_type = filename.replace('_e_sup.csv', ''), 'sup'
-                else:
-                    continue
-                if base_name not in file_pairs:
-                    file_pairs[base_name] = {}
-                file_pairs[base_name][file_type] = os.path.join(root, filename)
-        log_messages.append(f"Grouping complete. Found {len(file_pairs)} unique base names to process.")
-        log_messages.append("\n--- Part 2: Processing Pairs for Final Compilation ---")
-        all_dataframes = []
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            filename = os.path.basename(info.filename)
+            if filename.startswith('._') or not filename.endswith((DETAIL_SUFFIX, SUP_SUFFIX)):
+                continue
+            if filename.endswith(DETAIL_SUFFIX):
+                base_name, file_type = filename[:-len(DETAIL_SUFFIX)], 'detail'
+            else:
+                base_name, file_type = filename[:-len(SUP_SUFFIX)], 'sup'
+            file_pairs.setdefault(base_name, {})[file_type] = info
+        print(f"Grouping complete. Found {len(file_pairs)} unique base names to process.", file=log)
+        print("\n--- Part 2: Processing Pairs for Final Compilation ---", file=log)
+        all_tables = []
         source_row_counter = 0
         success_count, skipped_count = 0, 0
         if not file_pairs:
-            log_messages.append("❌ No file pairs were found to process.")
-            return None, "\n".join(log_messages)
-        for base_name, paths in sorted(file_pairs.items()):
-            if 'detail' in paths:
-                try:
-                    detail_df = pd.read_csv(paths['detail'])
-                    source_row_counter += len(detail_df)
-                    combined_df_for_pair = detail_df
-                    if 'sup' in paths:
-                        try:
-                            sup_df = pd.read_csv(paths['sup'])
-                            if not sup_df.empty:
-                                source_row_counter += len(sup_df)
-                                combined_df_for_pair = pd.concat([detail_df, sup_df], ignore_index=True)
-                        except pd.errors.EmptyDataError:
-                            pass
-                    all_dataframes.append(combined_df_for_pair)
-                    log_messages.append(f"  -> Processed: {base_name}")
+            print("❌ No file pairs were found to process.", file=log)
+            return None, log.getvalue(), False
+        # Reads are I/O-bound and the CSV parser releases the GIL, so pairs are
+        # read concurrently (ZipFile serialises access to the underlying file,
+        # so members can be opened from several threads). Pairs are submitted
+        # and concatenated in archive order, which is deterministic for a given
+        # zip; only the log lines are sorted by base name, once, at the end.
+        # Each parsed pair is spilled to disk as soon as it is read, so heap
+        # usage stays at the pairs in flight rather than growing with the whole
+        # dataset. The concat and the ArrowDtype conversion to pandas are
+        # zero-copy, so the master DataFrame's plain columns stay memory-mapped
+        # views of the spill files; dictionary-encoded columns are rebuilt on
+        # the heap, at their (smaller) encoded size. The spill directory lives
+        # in CACHE_DIR rather than the system temp dir, which is often a tmpfs
+        # and would keep the "spilled" data in RAM; the temp dir is only used
+        # when CACHE_DIR can't be written. On POSIX the mappings stay valid
+        # after the directory is removed.
+        column_plan = {}
+        with _make_spill_dir(log) as spill_dir, \
+                ThreadPoolExecutor(max_workers=min(32, len(file_pairs))) as pool:
+            futures = {
+                pool.submit(_process_pair, zip_ref, upload_view, column_plan, base_name, members, spill_dir): base_name
+                for base_name, members in file_pairs.items()
+            }
+            pair_tables, pair_logs = {}, {}
+            for future in as_completed(futures):
+                tables, rows_detail, rows_sup, status, msg = future.result()
+                source_row_counter += rows_detail + rows_sup
+                if status == 'processed':
                     success_count += 1
-                except Exception as e:
-                    log_messages.append(f"  -> ❌ ERROR processing {base_name}: {e}")
+                else:
                     skipped_count += 1
-            else:
-                log_messages.append(f"  -> ⚠️ WARNING: Skipping {base_name} (essential detail file is missing).")
-                skipped_count += 1
-        log_messages.append("\n--- Part 3: Compiling Final Output ---")
-        if all_dataframes:
+                pair_tables[futures[future]] = tables
+                pair_logs[futures[future]] = msg
+        for base_name in file_pairs:
+            if pair_tables[base_name] is not None:
+                all_tables.extend(pair_tables[base_name])
+        for base_name in sorted(pair_logs):
+            print(pair_logs[base_name], file=log)
+        print("\n--- Part 3: Compiling Final Output ---", file=log)
+        if all_tables:
             try:
-                master_df = pd.concat(all_dataframes, ignore_index=True)
-                final_df_rows = len(master_df)
-                summary = [
-                    "\n" + "="*40, "          PROCESS COMPLETE: SUMMARY", "="*40,
-                    f"Total base names processed successfully: {success_count}",
-                    f"Total base names skipped or failed:    {skipped_count}",
-                    "-" * 40, "Data Integrity Verification:",
-                    f"  - Sum of rows from all source files:  {source_row_counter:,}",
-                    f"  - Total rows in the final master file:  {final_df_rows:,}", "-" * 40
-                ]
+                master_tbl = _dictionary_encode_low_cardinality(_concat_unified(all_tables))
+                final_df_rows = master_tbl.num_rows
+                print("\n" + "="*40, "          PROCESS COMPLETE: SUMMARY", "="*40, sep="\n", file=log)
+                print(f"Total base names processed successfully: {success_count}", file=log)
+                print(f"Total base names skipped or failed:    {skipped_count}", file=log)
+                print("-" * 40, "Data Integrity Verification:", sep="\n", file=log)
+                print(f"  - Sum of rows from all source files:  {source_row_counter:,}", file=log)
+                print(f"  - Total rows in the final master file:  {final_df_rows:,}", file=log)
+                print("-" * 40, file=log)
                 if final_df_rows == source_row_counter:
-                    summary.append("✅ VERIFICATION PASSED: The row counts match perfectly.")
+                    print("✅ VERIFICATION PASSED: The row counts match perfectly.", file=log)
                 else:
                     mismatch = abs(final_df_rows - source_row_counter)
-                    summary.append(f"❌ VERIFICATION FAILED: Mismatch of {mismatch:,} rows detected.")
-                summary.append("="*40)
-                log_messages.extend(summary)
-                return master_df, "\n".join(log_messages)
+                    print(f"❌ VERIFICATION FAILED: Mismatch of {mismatch:,} rows detected.", file=log)
+                print("="*40, file=log)
+                # Only clean compiles are cached; a partial result is rebuilt on the
+                # next upload, so a transient failure is not replayed from cache.
+                is_cached = False
+                if skipped_count == 0 and final_df_rows == source_row_counter:
+                    try:
+                        _write_cached_master(master_tbl, log.getvalue(), cache_path)
+                        is_cached = True
+                    except Exception as e:
+                        print(f"⚠️ WARNING: Could not cache the compiled result. Reason: {e}", file=log)
+                master_df = master_tbl.to_pandas(types_mapper=_arrow_types_mapper, self_destruct=True)
+                return master_df, log.getvalue(), is_cached
             except Exception as e:
-                log_messages.append(f"❌ CRITICAL ERROR during final compilation: {e}")
-                return None, "\n".join(log_messages)
+                print(f"❌ CRITICAL ERROR during final compilation: {e}", file=log)
+                return None, log.getvalue(), False
         else:
-            log_messages.append("No data was successfully processed, so no master file was created.")
-            return None, "\n".join(log_messages)
+            print("No data was successfully processed, so no master file was created.", file=log)
+            return None, log.getvalue(), False
 
 # =============================================================================
 # ---                  STREAMLIT USER INTERFACE (FINAL)                     ---
 # =============================================================================
 
-@st.cache_data
-def convert_df_to_csv(df):
+def _write_csv_with_bom(df, sink):
     """
-    Converts a DataFrame to a UTF-8 encoded CSV file with a Byte Order Mark (BOM),
-    ensuring Excel opens it correctly with special characters.
+    Writes a DataFrame to `sink` as UTF-8 CSV with a Byte Order Mark (BOM),
+    ensuring Excel opens it correctly with special characters. Rows are
+    serialized by PyArrow's C++ CSV writer instead of pandas' Python formatter.
     """
-    # Use 'utf-8-sig' to add the BOM, which makes Excel read the file correctly.
-    return df.to_csv(index=False, encoding='utf-8-sig').encode('utf-8')
+    # Write the BOM first, which makes Excel read the file correctly.
+    sink.write(codecs.BOM_UTF8)
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), sink,
+                    write_options=pacsv.WriteOptions(include_header=True))
+
+def convert_df_to_csv_file(df, *, cache_key: str):
+    """
+    Writes a DataFrame to a CSV file with BOM (see _write_csv_with_bom) and
+    returns its path. `cache_key` must identify the DataFrame's contents: the
+    file is kept in CACHE_DIR under that key, so reruns and later runs reuse it
+    instead of serializing again. This saves CPU, not memory:
+    st.download_button reads the whole file into memory on each render.
+    Raises OSError if CACHE_DIR can't be written.
+    """
+    csv_path = _cache_path(cache_key, '.csv')
+    if not os.path.exists(csv_path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        os.close(fd)
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                _write_csv_with_bom(df, sink)
+            os.replace(tmp_path, csv_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    _evict_cache_entries('.csv', csv_path)
+    return csv_path
+
+def convert_df_to_csv_buffer(df):
+    """In-memory counterpart of convert_df_to_csv_file, for when CACHE_DIR can't be written."""
+    buf = io.BytesIO()
+    _write_csv_with_bom(df, buf)
+    buf.seek(0)
+    return buf
 
 st.title('📂 Master CSV Compiler')
 st.markdown("This tool takes a `.zip` file, combines all `_e_detail.csv` and `_e_sup.csv` files, and provides the compiled data for download as a single CSV file.")
@@ -129,14 +568,25 @@ if 'log_text' not in st.session_state:
     st.session_state.log_text = ""
 if 'master_df' not in st.session_state:
     st.session_state.master_df = None
+if 'preview_df' not in st.session_state:
+    st.session_state.preview_df = None
+if 'csv_key' not in st.session_state:
+    st.session_state.csv_key = None
 
 uploaded_csv_zip = st.file_uploader("Upload Your Zipped CSV Data", type="zip")
 
 if st.button('🚀 Start Compilation', type="primary", disabled=(not uploaded_csv_zip)):
     with st.spinner('Processing... This may take a moment.'):
-        df, log = compile_csv_files_from_zip(uploaded_csv_zip)
+        # Hashed once per click: the hash keys both the compile and the CSV cache.
+        zip_hash = _zip_hash(uploaded_csv_zip.getvalue())
+        df, log, is_cached = compile_csv_files_from_zip(uploaded_csv_zip, zip_hash)
         st.session_state.master_df = df
+        # The preview is sliced once here rather than on every rerun.
+        st.session_state.preview_df = df.head(10).copy() if df is not None else None
         st.session_state.log_text = log
+        # Only the cached clean master shares its CSV export with other sessions;
+        # any other result gets a file of its own.
+        st.session_state.csv_key = zip_hash if is_cached else f"{zip_hash}-{uuid.uuid4().hex}"
 
 # Display results if they exist in the session state
 if st.session_state.log_text:
@@ -145,20 +595,25 @@ if st.session_state.log_text:
     
     if st.session_state.master_df is not None:
         st.success("Compilation successful!")
-        st.dataframe(st.session_state.master_df.head(10))
+        st.dataframe(st.session_state.preview_df)
         
         st.subheader("Download Compiled Data")
         st.info("Click the button below to download the final compiled data. The CSV file is formatted to open correctly in Excel.")
         
-        # Convert DataFrame to a CSV file with BOM for Excel compatibility
-        csv_data = convert_df_to_csv(st.session_state.master_df)
+        # Write the DataFrame to a CSV file with BOM for Excel compatibility, or
+        # build it in memory if the cache folder can't be written
+        try:
+            csv_source = open(convert_df_to_csv_file(st.session_state.master_df, cache_key=st.session_state.csv_key), 'rb')
+        except OSError:
+            csv_source = convert_df_to_csv_buffer(st.session_state.master_df)
         
-        st.download_button(
-           label="📥 Download Master CSV File",
-           data=csv_data,
-           file_name="master_compiled_data.csv",
-           mime="text/csv"
-        )
+        with csv_source as csv_file:
+            st.download_button(
+               label="📥 Download Master CSV File",
+               data=csv_file,
+               file_name="master_compiled_data.csv",
+               mime="text/csv"
+            )
 
 else:
     st.info("Please upload a CSV zip file to begin the compilation process.")
@@ -0,0 +1,337 @@
+"""
+Tests for the compilation logic in myscript.py, run against in-memory zips
+built with both stored and deflated members. Run with `python -m pytest`.
+"""
+import importlib.util
+import io
+import logging
+import os
+import zipfile
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+# Importing the app also renders its UI in Streamlit's bare mode, which only
+# logs warnings about the missing script run context.
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+_spec = importlib.util.spec_from_file_location(
+    "myscript", os.path.join(os.path.dirname(__file__), os.pardir, "myscript.py"))
+myscript = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(myscript)
+
+HEADER = "AC_NO,PART_NO,EPIC_NO,NAME\n"
+
+
+@pytest.fixture(params=[zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED], ids=["stored", "deflated"])
+def compression(request):
+    return request.param
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(myscript, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def make_zip(members, compression=zipfile.ZIP_STORED):
+    """Builds an uploaded-file stand-in holding `members` (name -> str or bytes)."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, data in members.items():
+            zf.writestr(zipfile.ZipInfo(name, (2020, 1, 1, 0, 0, 0)), data, compression)
+    return io.BytesIO(buf.getvalue())
+
+
+def read_one(members, name, column_plan=None, compression=zipfile.ZIP_STORED):
+    upload = make_zip(members, compression)
+    with zipfile.ZipFile(upload) as zf:
+        return myscript._read_member(zf, upload.getbuffer(), zf.getinfo(name),
+                                     {} if column_plan is None else column_plan)
+
+
+def compile_zip(members, compression=zipfile.ZIP_STORED):
+    upload = make_zip(members, compression)
+    return myscript.compile_csv_files_from_zip(upload, myscript._zip_hash(upload.getvalue()))
+
+
+# --- Reading members ---------------------------------------------------------
+
+def test_empty_member_raises_empty_data_error(compression):
+    with pytest.raises(pd.errors.EmptyDataError):
+        read_one({"a.csv": ""}, "a.csv", compression=compression)
+
+
+def test_header_only_member_has_no_rows(compression):
+    tbl = read_one({"a.csv": HEADER}, "a.csv", compression=compression)
+    assert tbl.num_rows == 0
+    assert tbl.column_names == HEADER.strip().split(",")
+
+
+def test_bom_and_crlf_members(compression):
+    for data in ("\ufeffAC_NO,NAME\r\n1,Asha\r\n".encode("utf-8"), "AC_NO,NAME\r\n1,Asha\r\n"):
+        tbl = read_one({"a.csv": data}, "a.csv", compression=compression)
+        assert tbl.to_pydict() == {"AC_NO": [1], "NAME": ["Asha"]}
+
+
+def test_short_rows_are_padded(compression):
+    tbl = read_one({"a.csv": "A,B,C\n1,2,3\n4,5\n"}, "a.csv", compression=compression)
+    assert tbl.to_pydict() == {"A": [1, 4], "B": [2, 5], "C": [3.0, None]}
+
+
+def test_pandas_fallback_keeps_known_column_types(compression):
+    data = HEADER + "1,1,0123,Asha\n2,2,0456\n3,3,ABC9,Kiran\n"
+    tbl = read_one({"a.csv": data}, "a.csv", compression=compression)
+    assert tbl.column("EPIC_NO").to_pylist() == ["0123", "0456", "ABC9"]
+    assert tbl.schema.field("EPIC_NO").type == pa.string()
+    assert tbl.schema.field("AC_NO").type == pa.int32()
+
+
+# --- Pair processing ---------------------------------------------------------
+
+def test_pairs_are_compiled_in_archive_order_and_logged_by_name(compression):
+    df, log, _ = compile_zip({
+        "data/AC2_e_detail.csv": HEADER + "2,1,XYZ1,Kiran\n",
+        "data/AC1_e_detail.csv": HEADER + "1,1,ABC1,Asha\n1,2,ABC2,Ravi\n",
+        "data/AC1_e_sup.csv": HEADER + "1,3,ABC3,Meera\n",
+    }, compression)
+    assert df["EPIC_NO"].tolist() == ["XYZ1", "ABC1", "ABC2", "ABC3"]
+    assert str(df["AC_NO"].dtype) == "int32[pyarrow]"
+    assert log.index("Processed: AC1") < log.index("Processed: AC2")
+    assert "✅ VERIFICATION PASSED" in log
+
+
+def test_header_only_and_empty_members(compression):
+    df, log, _ = compile_zip({
+        "AC1_e_detail.csv": HEADER,
+        "AC1_e_sup.csv": HEADER + "1,1,ABC1,Asha\n",
+        "AC2_e_detail.csv": HEADER + "2,1,XYZ1,Kiran\n",
+        "AC2_e_sup.csv": "",
+        "AC3_e_detail.csv": "",
+    }, compression)
+    assert df["EPIC_NO"].tolist() == ["ABC1", "XYZ1"]
+    assert "Processed: AC1" in log and "Processed: AC2" in log
+    assert "ERROR processing AC3" in log
+
+
+# --- Result cache ------------------------------------------------------------
+
+def test_only_clean_compiles_are_cached(cache_dir):
+    _, _, is_cached = compile_zip({"AC1_e_detail.csv": "A\n1\n", "AC2_e_sup.csv": "A\n2\n"})
+    assert not is_cached
+    assert not list(cache_dir.glob("*.parquet"))
+    upload_members = {"AC1_e_detail.csv": "A\n1\n"}
+    _, _, is_cached = compile_zip(upload_members)
+    assert is_cached
+    assert len(list(cache_dir.glob(f"v{myscript.CACHE_VERSION}-*.parquet"))) == 1
+    _, log, is_cached = compile_zip(upload_members)
+    assert is_cached
+    assert log.startswith("✔️ This zip file was compiled before.")
+
+
+def test_cache_hit_marks_the_entry_used(cache_dir):
+    upload_members = {"AC1_e_detail.csv": "A\n1\n"}
+    compile_zip(upload_members)
+    (cache_path,) = cache_dir.glob("*.parquet")
+    os.utime(cache_path, (0, 0))
+    compile_zip(upload_members)
+    assert cache_path.stat().st_mtime > 0
+
+
+# --- CSV download ------------------------------------------------------------
+
+def test_csv_export_has_bom_and_is_reused(cache_dir):
+    df = pd.DataFrame({"A": [1, 2], "B": ["x", "y"]})
+    path = myscript.convert_df_to_csv_file(df, cache_key="k")
+    content = open(path, "rb").read()
+    assert content == b'\xef\xbb\xbf"A","B"\n1,"x"\n2,"y"\n'
+    assert content == myscript.convert_df_to_csv_buffer(df).getvalue()
+    # Same key, same file: a second call doesn't serialize again.
+    assert myscript.convert_df_to_csv_file(df.head(1), cache_key="k") == path
+    assert open(path, "rb").read() == content
+
+
+def test_csv_exports_are_evicted_least_recently_used(cache_dir):
+    df = pd.DataFrame({"A": [1]})
+    paths = [myscript.convert_df_to_csv_file(df, cache_key=f"k{i}") for i in range(myscript.MAX_CACHE_ENTRIES)]
+    for i, path in enumerate(paths):
+        os.utime(path, (1000 + i, 1000 + i))
+    myscript.convert_df_to_csv_file(df, cache_key="k0")
+    myscript.convert_df_to_csv_file(df, cache_key="new")
+    kept = ["k0"] + [f"k{i}" for i in range(2, myscript.MAX_CACHE_ENTRIES)] + ["new"]
+    assert sorted(p.name for p in cache_dir.glob("*.csv")) == sorted(f"v{myscript.CACHE_VERSION}-{k}.csv" for k in kept)
+
+
+def test_csv_export_raises_when_cache_dir_is_unusable(tmp_path, monkeypatch):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    monkeypatch.setattr(myscript, "CACHE_DIR", str(blocker / "cache"))
+    with pytest.raises(OSError):
+        myscript.convert_df_to_csv_file(pd.DataFrame({"A": [1]}), cache_key="k")
+
+
+# --- Spill directories -------------------------------------------------------
+
+def test_compile_falls_back_when_cache_dir_is_unusable(tmp_path, monkeypatch):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    monkeypatch.setattr(myscript, "CACHE_DIR", str(blocker / "cache"))
+    df, log, _ = compile_zip({"AC1_e_detail.csv": "A\n1\n"})
+    assert df["A"].tolist() == [1]
+    assert "Could not use the cache folder" in log
+
+
+def test_stale_spill_dirs_are_removed(cache_dir):
+    stale, fresh = cache_dir / "spill-stale", cache_dir / "spill-fresh"
+    stale.mkdir()
+    fresh.mkdir()
+    os.utime(stale, (0, 0))
+    compile_zip({"AC1_e_detail.csv": "A\n1\n"})
+    assert sorted(p.name for p in cache_dir.glob("spill-*")) == ["spill-fresh"]
+
+
+# --- Schema unification ------------------------------------------------------
+
+def test_reordered_and_missing_columns(compression):
+    df, _, _ = compile_zip({
+        "AC1_e_detail.csv": "AC_NO,NAME\n1,Asha\n",
+        "AC2_e_detail.csv": "NAME,AC_NO,STATUS\nRavi,2,N\n",
+    }, compression)
+    assert df.columns.tolist() == ["AC_NO", "NAME", "STATUS"]
+    assert df["NAME"].tolist() == ["Asha", "Ravi"]
+    assert df["STATUS"].isna().tolist() == [True, False]
+
+
+@pytest.mark.parametrize("detail, sup", [("12A", "13"), ("13", "12A")])
+def test_type_drift_falls_back_to_text_in_any_order(compression, detail, sup):
+    df, log, _ = compile_zip({
+        "AC1_e_detail.csv": f"H\n{detail}\n",
+        "AC1_e_sup.csv": f"H\n{sup}\n",
+    }, compression)
+    assert df is not None, log
+    assert df["H"].tolist() == [detail, sup]
+
+
+def test_duplicate_header_names_are_renamed(compression):
+    df, log, _ = compile_zip({
+        "AC1_e_detail.csv": "X,X\n1,2\n",
+        "AC2_e_detail.csv": "X,X\n3,4\n",
+    }, compression)
+    assert df is not None, log
+    assert df.to_dict("list") == {"X": [1, 3], "X.1": [2, 4]}
+
+
+@pytest.mark.parametrize("header", ["X,X", "X,X,X", "X,X,X.1", "X,X.1,X"])
+def test_duplicate_names_match_pandas(header):
+    row = ",".join("1" * len(header.split(",")))
+    tbl = myscript._read_csv_fast(pa.py_buffer(f"{header}\n{row}\n".encode()))
+    assert tbl.column_names == pd.read_csv(io.StringIO(f"{header}\n{row}\n")).columns.tolist()
+
+
+def test_concat_unified_single_table_is_unchanged():
+    tbl = pa.table({"A": [1]})
+    assert myscript._concat_unified([tbl]) is tbl
+
+
+def test_concat_unified_reorders_and_null_fills():
+    result = myscript._concat_unified([
+        pa.table({"A": [1], "B": ["x"]}),
+        pa.table({"B": ["y"], "A": [2], "C": [True]}),
+    ])
+    assert result.column_names == ["A", "B", "C"]
+    assert result.to_pydict() == {"A": [1, 2], "B": ["x", "y"], "C": [None, True]}
+
+
+def test_concat_unified_widens_numbers_and_stringifies_conflicts():
+    result = myscript._concat_unified([
+        pa.table({"N": pa.array([1], pa.int32()), "S": [1]}),
+        pa.table({"N": [2.5], "S": ["abc"]}),
+    ])
+    assert result.schema.field("N").type == pa.float64()
+    assert result.to_pydict() == {"N": [1.0, 2.5], "S": ["1", "abc"]}
+
+
+# --- Dictionary encoding -----------------------------------------------------
+
+def test_only_low_cardinality_strings_are_dictionary_encoded():
+    tbl = myscript._dictionary_encode_low_cardinality(pa.table({
+        "GENDER": ["M", "F", "M", "M", "M"],        # 2 distinct in 5 rows: below the ratio
+        "NAME": ["a", "b", "a", "b", "c"],          # 3 distinct in 5 rows: above it
+        "AC_NO": [1, 1, 1, 1, 1],                   # not a string column
+    }))
+    assert pa.types.is_dictionary(tbl.schema.field("GENDER").type)
+    assert tbl.schema.field("NAME").type == pa.string()
+    assert tbl.schema.field("AC_NO").type == pa.int64()
+    assert tbl.column("GENDER").to_pylist() == ["M", "F", "M", "M", "M"]
+
+
+def test_categorical_survives_the_cache_round_trip():
+    members = {"AC1_e_detail.csv": "NAME,GENDER\n" + "".join(f"N{i},{'MF'[i % 2]}\n" for i in range(10))}
+    compiled, _, _ = compile_zip(members)
+    cached, log, _ = compile_zip(members)
+    assert log.startswith("✔️ This zip file was compiled before.")
+    for df in (compiled, cached):
+        assert isinstance(df["GENDER"].dtype, pd.CategoricalDtype)
+        assert str(df["NAME"].dtype) == "string[pyarrow]"
+    assert cached["GENDER"].tolist() == compiled["GENDER"].tolist()
+
+
+# --- Zero-copy reads of stored members ---------------------------------------
+
+def test_stored_member_buffer_parses_local_header():
+    payload = b"A,B\n1,2\n"
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        info = zipfile.ZipInfo("AC1_e_detail.csv", (2020, 1, 1, 0, 0, 0))
+        info.extra = b"\xfe\xca\x04\x00" + b"\x00" * 4
+        zf.writestr(info, payload)
+    upload = io.BytesIO(b"junk before the archive" + buf.getvalue())
+    with zipfile.ZipFile(upload) as zf:
+        data = myscript._stored_member_buffer(upload.getbuffer(), zf.getinfo("AC1_e_detail.csv"))
+    assert data.to_pybytes() == payload
+
+
+def test_stored_member_buffer_skips_deflated_members():
+    upload = make_zip({"AC1_e_detail.csv": "A\n1\n"}, zipfile.ZIP_DEFLATED)
+    with zipfile.ZipFile(upload) as zf:
+        assert myscript._stored_member_buffer(upload.getbuffer(), zf.getinfo("AC1_e_detail.csv")) is None
+
+
+def test_stored_member_buffer_checks_crc():
+    raw = bytearray(make_zip({"AC1_e_detail.csv": "A,B\n1,2\n"}).getvalue())
+    raw[raw.find(b"1,2")] = ord("7")
+    upload = io.BytesIO(bytes(raw))
+    with zipfile.ZipFile(upload) as zf, pytest.raises(zipfile.BadZipFile):
+        myscript._stored_member_buffer(upload.getbuffer(), zf.getinfo("AC1_e_detail.csv"))
+
+
+# --- Column plan -------------------------------------------------------------
+
+def test_plan_records_names_only(compression):
+    column_plan = {}
+    read_one({"a.csv": "A,B\n1,x\n"}, "a.csv", column_plan, compression)
+    assert column_plan["plan"] == (b"A,B\n", ["A", "B"])
+
+
+def test_plan_skips_quoted_headers(compression):
+    column_plan = {}
+    read_one({"a.csv": '"A",B\n1,x\n'}, "a.csv", column_plan, compression)
+    assert column_plan == {}
+
+
+def test_plan_reads_matching_header_with_inferred_types(compression):
+    column_plan = {"plan": (b"A,B\n", ["A", "B"])}
+    tbl = read_one({"a.csv": "A,B\nx,1.5\n"}, "a.csv", column_plan, compression)
+    assert tbl.schema.types == [pa.string(), pa.float64()]
+
+
+@pytest.mark.parametrize("data, rows", [
+    ("A,B\n", 0),               # header only: nothing left to parse after the header
+    ("A,B\n1,2\n3\n", 2),       # short row: re-read from the start, padded by pandas
+    ("B,A\n2,1\n", 1),          # different header: not read through the plan
+])
+def test_plan_fallbacks(compression, data, rows):
+    column_plan = {"plan": (b"A,B\n", ["A", "B"])}
+    tbl = read_one({"a.csv": data}, "a.csv", column_plan, compression)
+    assert tbl.num_rows == rows
+    assert tbl.column_names == data.splitlines()[0].split(",")